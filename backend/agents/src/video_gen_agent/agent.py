@@ -19,6 +19,7 @@ from freepik_gemini import (
     _create_video_task,
     _wait_for_video_task,
     _download_file,
+    run_sync,
     FreepikGeminiError
 )
 
@@ -134,15 +135,15 @@ def generate_image(state: VideoGenAgent) -> VideoGenAgent:
         base_prompt = state.get("base_prompt") or state["prompt"]
         
         # Create image generation task
-        task_id = _create_gemini_task(api_key=api_key, prompt=base_prompt)
+        task_id = run_sync(_create_gemini_task(api_key=api_key, prompt=base_prompt))
         
         # Wait for image generation
-        generated_urls = _wait_for_gemini_task(
+        generated_urls = run_sync(_wait_for_gemini_task(
             api_key=api_key,
             task_id=task_id,
             timeout=120,
             poll_interval=2.0
-        )
+        ))
         
         if not generated_urls:
             raise FreepikGeminiError("No images generated")
@@ -152,7 +153,7 @@ def generate_image(state: VideoGenAgent) -> VideoGenAgent:
         # Download and save the image
         image_filename = f"{uuid.uuid4()}_image.png"
         image_path = OUTPUT_DIR / image_filename
-        _download_file(image_url, str(image_path))
+        run_sync(_download_file(image_url, str(image_path)))
         
         return {
             "image_url": image_url,
@@ -177,19 +178,19 @@ def generate_video(state: VideoGenAgent) -> VideoGenAgent:
         image_url = state["image_url"]
         
         # Create video generation task
-        task_id = _create_video_task(
+        task_id = run_sync(_create_video_task(
             api_key=api_key,
             image_url=image_url,
             prompt=ad_prompt
-        )
+        ))
         
         # Wait for video generation
-        video_url = _wait_for_video_task(
+        video_url = run_sync(_wait_for_video_task(
             api_key=api_key,
             task_id=task_id,
             timeout=180,
             poll_interval=2.0
-        )
+        ))
         
         if not video_url:
             raise FreepikGeminiError("No video generated")
@@ -197,7 +198,7 @@ def generate_video(state: VideoGenAgent) -> VideoGenAgent:
         # Download and save the video
         video_filename = f"{uuid.uuid4()}_video.mp4"
         video_path = OUTPUT_DIR / video_filename
-        _download_file(video_url, str(video_path))
+        run_sync(_download_file(video_url, str(video_path)))
         
         return {
             "video_url": video_url,
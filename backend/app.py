@@ -1,28 +1,66 @@
 import os
+import math
+import time
+import mimetypes
 import uuid
-from flask import Flask, request, jsonify, send_file
+import orjson
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
-from pathlib import Path
-import threading
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
 
 # Import the functions from the original code
 from freepik_gemini import (
     two_step_gemini_image,
-    _create_gemini_task,
-    _wait_for_gemini_task,
+    generate_gemini_image,
     _download_file,
+    run_sync,
     FreepikGeminiError
 )
+from tasks import OUTPUT_DIR, get_task_state, redis_client, run_video_ad, set_task_state, task_channel
+
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson, for request.json and jsonify"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the bytes -> str -> bytes round trip of the base implementation
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype="application/json")
+
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app)
 
 # Configuration
-OUTPUT_DIR = Path("outputs")
-OUTPUT_DIR.mkdir(exist_ok=True)
+_OUT = str(OUTPUT_DIR)
+
+# Let the front-end server send file bodies instead of Python:
+#   USE_X_SENDFILE=1 for Apache/lighttpd (mod_xsendfile)
+#   X_ACCEL_REDIRECT_PREFIX=/outputs/ for nginx, with
+#     location /outputs/ { internal; alias /app/outputs/; }
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
+
+# Seconds between SSE keep-alive comments while waiting on task events
+SSE_HEARTBEAT = 15
 
-# Store task statuses in memory (use Redis/database for production)
-task_status = {}
+# A "working" task that hasn't reported for this many seconds is reported as
+# failed on its event stream (the worker most likely died without recording a
+# final state). Tasks still queued ("submitted") are bounded by the state TTL.
+SSE_MAX_WAIT = 15 * 60
+
+# States of a task that hasn't finished yet
+PENDING_STATES = ("submitted", "working")
 
 
 def get_api_key():
@@ -33,6 +71,25 @@ def get_api_key():
     return api_key
 
 
+def freepik_error_response(e):
+    """
+    Turn a FreepikGeminiError into a response: upstream 4xx are passed through
+    (with Retry-After on 429) so clients don't retry them, task timeouts are a
+    504, and anything else is a 502.
+    """
+    status = e.status if 400 <= e.status < 500 or e.status == 504 else 502
+    response = jsonify({"error": str(e)})
+    response.status_code = status
+    if status == 429 and e.retry_after is not None:
+        response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+    return response
+
+
+def use_cache():
+    """Cached Gemini results may be reused unless the request passes ?nocache=1"""
+    return request.args.get('nocache') != '1'
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -49,6 +106,8 @@ def generate_image():
         "prompt": "your image prompt",
         "reference_images": [...] (optional)
     }
+
+    Pass ?nocache=1 to skip the prompt cache.
     """
     try:
         api_key = get_api_key()
@@ -62,16 +121,15 @@ def generate_image():
         if not prompt:
             return jsonify({"error": "prompt is required"}), 400
 
-        # Create task
-        task_id = _create_gemini_task(api_key, prompt, reference_images)
-        
-        # Wait for completion
-        generated_urls = _wait_for_gemini_task(api_key, task_id)
+        # Create task and wait for completion (or reuse a cached result)
+        generated_urls = run_sync(generate_gemini_image(
+            api_key, prompt, reference_images, use_cache=use_cache()
+        ))
         
         # Download the first image
-        image_filename = f"{uuid.uuid4()}.png"
-        image_path = OUTPUT_DIR / image_filename
-        _download_file(generated_urls[0], str(image_path))
+        image_filename = uuid.uuid4().hex + ".png"
+        image_path = os.path.join(_OUT, image_filename)
+        run_sync(_download_file(generated_urls[0], image_path))
         
         return jsonify({
             "success": True,
@@ -81,7 +139,7 @@ def generate_image():
         }), 200
         
     except FreepikGeminiError as e:
-        return jsonify({"error": str(e)}), 500
+        return freepik_error_response(e)
     except Exception as e:
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
@@ -98,6 +156,8 @@ def create_video_ad():
         "timeout": 180 (optional),
         "poll_interval": 2.0 (optional)
     }
+
+    Pass ?nocache=1 to skip the prompt cache for the base image.
     """
     try:
         api_key = get_api_key()
@@ -114,21 +174,23 @@ def create_video_ad():
             return jsonify({"error": "base_prompt and ad_prompt are required"}), 400
 
         # Generate unique filenames
-        image_filename = f"{uuid.uuid4()}.png"
-        video_filename = f"{uuid.uuid4()}.mp4"
-        image_path = OUTPUT_DIR / image_filename
-        video_path = OUTPUT_DIR / video_filename
+        file_id = uuid.uuid4().hex
+        image_filename = file_id + ".png"
+        video_filename = file_id + ".mp4"
+        image_path = os.path.join(_OUT, image_filename)
+        video_path = os.path.join(_OUT, video_filename)
         
         # Run the two-step pipeline
-        base_image_path, video_output_path = two_step_gemini_image(
+        base_image_path, video_output_path = run_sync(two_step_gemini_image(
             api_key=api_key,
             base_prompt=base_prompt,
             ad_prompt=ad_prompt,
-            base_image_path=str(image_path),
-            video_output_path=str(video_path),
+            base_image_path=image_path,
+            video_output_path=video_path,
             timeout=timeout,
-            poll_interval=poll_interval
-        )
+            poll_interval=poll_interval,
+            use_cache=use_cache()
+        ))
         
         return jsonify({
             "success": True,
@@ -138,7 +200,7 @@ def create_video_ad():
         }), 200
         
     except FreepikGeminiError as e:
-        return jsonify({"error": str(e)}), 500
+        return freepik_error_response(e)
     except Exception as e:
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
@@ -153,6 +215,8 @@ def create_video_ad_async():
         "base_prompt": "prompt for base image",
         "ad_prompt": "prompt for video animation"
     }
+
+    Pass ?nocache=1 to skip the prompt cache for the base image.
     """
     try:
         api_key = get_api_key()
@@ -167,43 +231,31 @@ def create_video_ad_async():
             return jsonify({"error": "base_prompt and ad_prompt are required"}), 400
 
         # Generate task ID
-        task_id = str(uuid.uuid4())
-        task_status[task_id] = {"status": "processing", "progress": "Starting..."}
+        task_id = uuid.uuid4().hex
         
         # Generate unique filenames
         image_filename = f"{task_id}_image.png"
         video_filename = f"{task_id}_video.mp4"
-        image_path = OUTPUT_DIR / image_filename
-        video_path = OUTPUT_DIR / video_filename
-        
-        # Run in background thread
-        def background_task():
-            try:
-                task_status[task_id]["progress"] = "Generating base image..."
-                base_image_path, video_output_path = two_step_gemini_image(
-                    api_key=api_key,
-                    base_prompt=base_prompt,
-                    ad_prompt=ad_prompt,
-                    base_image_path=str(image_path),
-                    video_output_path=str(video_path)
-                )
-                task_status[task_id] = {
-                    "status": "completed",
-                    "base_image": f"/api/download/{image_filename}",
-                    "video": f"/api/download/{video_filename}"
-                }
-            except Exception as e:
-                task_status[task_id] = {
-                    "status": "failed",
-                    "error": str(e)
-                }
+        image_path = os.path.join(_OUT, image_filename)
+        video_path = os.path.join(_OUT, video_filename)
         
-        thread = threading.Thread(target=background_task)
-        thread.start()
+        # Hand off to a Celery worker
+        set_task_state(task_id, {"state": "submitted", "progress": "Starting..."})
+        try:
+            run_video_ad.apply_async(
+                args=(api_key, base_prompt, ad_prompt, image_path, video_path),
+                kwargs={"use_cache": use_cache()},
+                task_id=task_id
+            )
+        except Exception as e:
+            # Don't leave the task looking queued if it never reached the broker
+            set_task_state(task_id, {"state": "failed", "error": f"Could not queue task: {e}"})
+            raise
         
         return jsonify({
             "task_id": task_id,
-            "status_url": f"/api/task-status/{task_id}"
+            "status_url": f"/api/task-status/{task_id}",
+            "events_url": f"/api/task-events/{task_id}"
         }), 202
         
     except Exception as e:
@@ -213,20 +265,75 @@ def create_video_ad_async():
 @app.route('/api/task-status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
     """Get the status of an async task"""
-    if task_id not in task_status:
+    event = get_task_state(task_id)
+    if not event:
         return jsonify({"error": "Task not found"}), 404
-    
-    return jsonify(task_status[task_id]), 200
+
+    state = event.pop("state")
+    status = "processing" if state in PENDING_STATES else state
+    return jsonify({"status": status, **event}), 200
+
+
+@app.route('/api/task-events/<task_id>', methods=['GET'])
+def get_task_events(task_id):
+    """Stream the status of an async task as Server-Sent Events"""
+    if not get_task_state(task_id):
+        return jsonify({"error": "Task not found"}), 404
+
+    def generate():
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        # Subscribe before taking the snapshot so no update falls in between
+        pubsub.subscribe(task_channel(task_id))
+        try:
+            event = get_task_state(task_id)
+            if not event:
+                return
+            yield f"data: {orjson.dumps(event).decode()}\n\n"
+
+            while event["state"] in PENDING_STATES:
+                message = pubsub.get_message(timeout=SSE_HEARTBEAT)
+                if message is None:
+                    # No update for a while; make sure the task is still alive
+                    event = get_task_state(task_id)
+                    if not event:
+                        event = {"state": "failed", "error": "Task state expired"}
+                    elif (event["state"] == "working"
+                          and time.time() - float(event["updated_at"]) > SSE_MAX_WAIT):
+                        event = {"state": "failed", "error": "Task stopped reporting progress"}
+                    if event["state"] not in PENDING_STATES:
+                        yield f"data: {orjson.dumps(event).decode()}\n\n"
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                # Published events are already JSON; forward them as-is
+                event = orjson.loads(message["data"])
+                yield f"data: {message['data']}\n\n"
+        finally:
+            pubsub.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.route('/api/download/<filename>', methods=['GET'])
 def download_file(filename):
     """Download a generated file"""
-    file_path = OUTPUT_DIR / filename
-    if not file_path.exists():
+    if X_ACCEL_REDIRECT_PREFIX:
+        # nginx validates and serves the file from its internal location
+        accel_path = safe_join(X_ACCEL_REDIRECT_PREFIX, filename)
+        if accel_path is None:
+            return jsonify({"error": "File not found"}), 404
+        # nginx keeps the upstream Content-Type, so it must describe the file
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        return Response(mimetype=mimetype, headers={"X-Accel-Redirect": accel_path})
+
+    try:
+        return send_from_directory(OUTPUT_DIR, filename, conditional=True)
+    except NotFound:
         return jsonify({"error": "File not found"}), 404
-    
-    return send_file(file_path, as_attachment=False)
 
 
 @app.errorhandler(404)
@@ -242,4 +349,9 @@ def internal_error(e):
 if __name__ == '__main__':
     # Set your API key as environment variable or pass in headers
     # export FREEPIK_API_KEY=your_key_here
+    #
+    # The Werkzeug dev server is for local development only; in production
+    # run: gunicorn -c gunicorn.conf.py
+    if os.environ.get('FLASK_ENV') != 'development':
+        raise SystemExit("Run with gunicorn -c gunicorn.conf.py, or set FLASK_ENV=development")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
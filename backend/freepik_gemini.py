@@ -1,20 +1,299 @@
+import os
 import time
-import requests
-from pathlib import Path
+import random
+import asyncio
+import contextlib
+import hashlib
+import threading
+import httpx
+import orjson
+import aiofiles
+from cachetools import TTLCache
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional, TypeVar
 
 # === CONFIG ===
 FREEPIK_GEMINI_ENDPOINT = "https://api.freepik.com/v1/ai/gemini-2-5-flash-image-preview"
 VIDEO_MODEL = "kling-v2-5-pro"  # Change to pixverse-v5, seedance-lite-1080p, etc.
 FREEPIK_VIDEO_ENDPOINT = f"https://api.freepik.com/v1/ai/image-to-video/{VIDEO_MODEL}"
 
+# Transient upstream failures are retried with exponential backoff. POSTs
+# create paid tasks and a gateway error doesn't mean the task wasn't created,
+# so they are only retried on 429 (rejected before any work was done).
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.3
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+RETRY_STATUS_CODES_POST = {429}
+
+# At most this many Freepik API calls are in flight per process. The cap is
+# halved when more than RATE_LIMIT_THRESHOLD of the responses seen since the
+# last adjustment (at least RATE_LIMIT_MIN_SAMPLES of them) are 429s, and
+# grows back by one per interval while the share is at or below it.
+MAX_INFLIGHT = int(os.getenv("FREEPIK_MAX_INFLIGHT", "8"))
+RATE_LIMIT_WINDOW = 60.0
+RATE_LIMIT_THRESHOLD = 0.02
+RATE_LIMIT_MIN_SAMPLES = 20
+RATE_LIMIT_ADJUST_INTERVAL = 10.0
+
+# Task polling: wait before the first poll (image jobs take ~5-15 s, video
+# jobs ~60-120 s), then back off exponentially up to POLL_MAX_INTERVAL
+GEMINI_FIRST_POLL_DELAY = 3.0
+VIDEO_FIRST_POLL_DELAY = 30.0
+POLL_BACKOFF = 1.5
+POLL_MAX_INTERVAL = 10.0
+
+# Downloads are written in 1 MiB blocks
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Gemini task creation is coalesced into batches (see Batcher)
+GEMINI_BATCH_SIZE = 16
+GEMINI_BATCH_WAIT_MS = 50
+
+# Generated URLs for identical (api key, prompt, reference images) requests
+# are reused for an hour
+GEMINI_CACHE_SIZE = 1024
+GEMINI_CACHE_TTL = 3600
+
+
+T = TypeVar("T")
+
+# One HTTP/2 client shared by every pipeline, so polls reuse a single
+# connection (and TLS session) to api.freepik.com. The transport retries
+# failed connects; retryable status codes are handled in _request().
+_client = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=100),
+        retries=RETRY_TOTAL,
+    ),
+    follow_redirects=True,
+    timeout=30,
+)
+
+# The client is bound to the event loop it first runs on, so all calls go
+# through one long-lived loop in a background thread.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
 
 class FreepikGeminiError(Exception):
-    pass
+    """
+    A Freepik request failed. `status` is the upstream HTTP status where there
+    was one, 504 if a task didn't finish in time, and 500 otherwise;
+    `retry_after` is the upstream Retry-After, in seconds.
+    """
+
+    def __init__(self, msg: str, status: int = 500, retry_after: Optional[float] = None):
+        super().__init__(msg)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="freepik-io", daemon=True).start()
+    return _loop
+
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """
+    Run a coroutine from this module on the shared event loop and block until
+    it finishes. Use this from synchronous code (Flask views, Celery tasks, CLI).
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+class _AdaptiveLimiter:
+    """
+    Async context manager capping concurrent Freepik API calls. Responses
+    since the last adjustment are recorded in a sliding window, and at most
+    once per RATE_LIMIT_ADJUST_INTERVAL:
+
+    - if at least RATE_LIMIT_MIN_SAMPLES responses were seen and more than
+      RATE_LIMIT_THRESHOLD of them are 429s, the cap is halved (down to 1);
+    - if the share of 429s is at or below RATE_LIMIT_THRESHOLD, the cap is
+      raised by one until it is back at `limit`.
+
+    The window is cleared on every adjustment, so each 429 is judged once.
+    An isolated 429 under light traffic (fewer than RATE_LIMIT_MIN_SAMPLES
+    responses per window) never lowers the cap; it only holds it until the
+    429 leaves the window. A sustained 429 rate above the threshold halves
+    the cap every interval down to 1, where it stays until the rate drops.
+    """
+
+    def __init__(self, limit: int):
+        self._max_limit = limit
+        self.limit = limit
+        self._inflight = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._responses: deque[tuple[float, bool]] = deque()
+        self._last_adjust = 0.0
+
+    async def __aenter__(self):
+        # Created lazily so the condition belongs to the loop we run on
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._inflight < self.limit)
+            self._inflight += 1
+
+    async def __aexit__(self, *exc_info):
+        async with self._cond:
+            self._inflight -= 1
+            # Wake as many waiters as there are free slots (the cap may have grown)
+            self._cond.notify(max(self.limit - self._inflight, 0))
+
+    def record(self, status_code: int):
+        now = time.monotonic()
+        self._responses.append((now, status_code == 429))
+        while self._responses[0][0] < now - RATE_LIMIT_WINDOW:
+            self._responses.popleft()
+
+        if now - self._last_adjust < RATE_LIMIT_ADJUST_INTERVAL:
+            return
+
+        samples = len(self._responses)
+        limited = sum(1 for _, is_429 in self._responses if is_429)
+        if samples >= RATE_LIMIT_MIN_SAMPLES and limited / samples > RATE_LIMIT_THRESHOLD:
+            self.limit = max(self.limit // 2, 1)
+        elif limited / samples <= RATE_LIMIT_THRESHOLD and self.limit < self._max_limit:
+            self.limit += 1
+        else:
+            return
+        self._last_adjust = now
+        self._responses.clear()
+
+
+_freepik_limiter = _AdaptiveLimiter(MAX_INFLIGHT)
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    """Seconds from a Retry-After header, if present and numeric."""
+    try:
+        return float(resp.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _poll_delay(poll_interval: float, attempt: int) -> float:
+    """Exponential backoff capped at POLL_MAX_INTERVAL, with +/-20% jitter."""
+    delay = min(poll_interval * (POLL_BACKOFF ** attempt), POLL_MAX_INTERVAL)
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a Freepik API request, retrying 429/5xx gateway errors (429 only
+    for POST) with exponential backoff, honoring Retry-After when the
+    server sends one. Each attempt holds a slot in the shared in-flight
+    limiter; backoff sleeps do not.
+    """
+    retry_statuses = RETRY_STATUS_CODES_POST if method == "POST" else RETRY_STATUS_CODES
+    for attempt in range(RETRY_TOTAL + 1):
+        async with _freepik_limiter:
+            resp = await _client.request(method, url, **kwargs)
+        _freepik_limiter.record(resp.status_code)
+        if resp.status_code not in retry_statuses or attempt == RETRY_TOTAL:
+            return resp
+
+        delay = _retry_after(resp)
+        if delay is None:
+            delay = RETRY_BACKOFF_FACTOR * (2 ** attempt)
+        await asyncio.sleep(delay)
+
+
+# === REQUEST BATCHING ===
+
+class Batcher:
+    """
+    Coalesces calls that arrive within `max_wait_ms` of each other into
+    batches of up to `max_batch`, DataLoader-style.
+
+    `process` receives the list of submitted argument tuples and returns one
+    result (or exception instance) per call, in order. Callers only see
+    `await batcher.submit(*args)`, so the processor can be swapped for a
+    real batch endpoint without touching them.
+    """
+
+    def __init__(self, process: Callable[[list[tuple]], Awaitable[list[Any]]], *, max_batch: int = 16, max_wait_ms: int = 50):
+        self._process = process
+        self._max_batch = max_batch
+        self._max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, *args) -> Any:
+        # Created lazily so the queue belongs to the loop we run on
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._spawn(self._collect())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((args, future))
+        return await future
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_wait
+            while len(batch) < self._max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Dispatch without waiting so the next batch can start filling
+            self._spawn(self._dispatch(batch))
+
+    async def _dispatch(self, batch: list[tuple[tuple, asyncio.Future]]):
+        try:
+            results = await self._process([args for args, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
 
 
 # === GEMINI IMAGE GENERATION HELPERS ===
 
-def _create_gemini_task(api_key: str, prompt: str, reference_images=None) -> str:
+async def _create_gemini_tasks(calls: list[tuple]) -> list[Any]:
+    """
+    Batch processor for Gemini task creation. Freepik has no batch endpoint,
+    so each (api_key, prompt, reference_images) call is sent concurrently;
+    _request's limiter bounds how many are in flight.
+    """
+    return await asyncio.gather(*(_post_gemini_task(*call) for call in calls), return_exceptions=True)
+
+
+_gemini_batcher = Batcher(_create_gemini_tasks, max_batch=GEMINI_BATCH_SIZE, max_wait_ms=GEMINI_BATCH_WAIT_MS)
+
+
+async def _create_gemini_task(api_key: str, prompt: str, reference_images=None) -> str:
+    """
+    Create a Gemini image task via the shared batcher.
+    Returns task_id.
+    """
+    return await _gemini_batcher.submit(api_key, prompt, reference_images)
+
+
+async def _post_gemini_task(api_key: str, prompt: str, reference_images=None) -> str:
     """
     POST /v1/ai/gemini-2-5-flash-image-preview
     Returns task_id.
@@ -28,13 +307,15 @@ def _create_gemini_task(api_key: str, prompt: str, reference_images=None) -> str
     if reference_images:
         payload["reference_images"] = reference_images
 
-    resp = requests.post(FREEPIK_GEMINI_ENDPOINT, json=payload, headers=headers)
+    resp = await _request("POST", FREEPIK_GEMINI_ENDPOINT, content=orjson.dumps(payload), headers=headers)
     if resp.status_code != 200:
         raise FreepikGeminiError(
-            f"Error creating Gemini task: {resp.status_code} {resp.text}"
+            f"Error creating Gemini task: {resp.status_code} {resp.text}",
+            status=resp.status_code,
+            retry_after=_retry_after(resp)
         )
 
-    data = resp.json().get("data", {})
+    data = orjson.loads(resp.content).get("data", {})
     task_id = data.get("task_id")
     if not task_id:
         raise FreepikGeminiError(f"Missing task_id in response: {resp.text}")
@@ -42,23 +323,65 @@ def _create_gemini_task(api_key: str, prompt: str, reference_images=None) -> str
     return task_id
 
 
-def _wait_for_gemini_task(api_key: str, task_id: str, timeout: int = 120, poll_interval: float = 2.0) -> list[str]:
+_gemini_cache: TTLCache = TTLCache(maxsize=GEMINI_CACHE_SIZE, ttl=GEMINI_CACHE_TTL)
+
+
+def _gemini_cache_key(api_key: str, prompt: str, reference_images=None) -> str:
+    """Cache key for a Gemini request; scoped per API key, which is never stored in clear."""
+    payload = {"k": api_key, "p": prompt, "r": reference_images}
+    return hashlib.sha256(orjson.dumps(payload, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+async def generate_gemini_image(api_key: str, prompt: str, reference_images=None, *, timeout: int = 120, poll_interval: float = 2.0, use_cache: bool = True) -> list[str]:
+    """
+    Create a Gemini task and wait for it, returning the generated URLs.
+    Identical recent requests are answered from an in-process LRU cache
+    unless `use_cache` is False.
+    """
+    key = _gemini_cache_key(api_key, prompt, reference_images)
+    if use_cache and key in _gemini_cache:
+        return _gemini_cache[key]
+
+    task_id = await _create_gemini_task(api_key, prompt, reference_images)
+    generated_urls = await _wait_for_gemini_task(api_key, task_id, timeout=timeout, poll_interval=poll_interval)
+    _gemini_cache[key] = generated_urls
+    return generated_urls
+
+
+async def _wait_for_gemini_task(api_key: str, task_id: str, timeout: int = 120, poll_interval: float = 2.0) -> list[str]:
     """
     GET /v1/ai/gemini-2-5-flash-image-preview/{task-id} in a loop
-    until generated URLs are available or timeout.
+    until generated URLs are available or timeout. Polls start at
+    `poll_interval` and back off exponentially (see _poll_delay).
     """
     headers = {"x-freepik-api-key": api_key}
     url = f"{FREEPIK_GEMINI_ENDPOINT}/{task_id}"
     start = time.time()
+    attempt = 0
+    status = None
+
+    await asyncio.sleep(min(GEMINI_FIRST_POLL_DELAY, timeout))
 
     while True:
-        resp = requests.get(url, headers=headers)
+        resp = await _request("GET", url, headers=headers)
+        if resp.status_code == 429:
+            if time.time() - start > timeout:
+                raise FreepikGeminiError(
+                    f"Timeout waiting for task {task_id}, last status={status} (rate limited)",
+                    status=429,
+                    retry_after=_retry_after(resp)
+                )
+            await asyncio.sleep(_retry_after(resp) or _poll_delay(poll_interval, attempt))
+            attempt += 1
+            continue
         if resp.status_code != 200:
             raise FreepikGeminiError(
-                f"Error getting Gemini task status: {resp.status_code} {resp.text}"
+                f"Error getting Gemini task status: {resp.status_code} {resp.text}",
+                status=resp.status_code,
+                retry_after=_retry_after(resp)
             )
 
-        data = resp.json().get("data", {})
+        data = orjson.loads(resp.content).get("data", {})
         status = data.get("status")
         generated = data.get("generated") or []
 
@@ -67,31 +390,34 @@ def _wait_for_gemini_task(api_key: str, task_id: str, timeout: int = 120, poll_i
 
         if time.time() - start > timeout:
             raise FreepikGeminiError(
-                f"Timeout waiting for task {task_id}, last status={status}, data={data}"
+                f"Timeout waiting for task {task_id}, last status={status}, data={data}",
+                status=504
             )
 
-        time.sleep(poll_interval)
+        await asyncio.sleep(_poll_delay(poll_interval, attempt))
+        attempt += 1
 
 
-def _download_file(url: str, output_path: str):
+async def _download_file(url: str, output_path: str):
     """
-    Download an image or video URL and save it to output_path.
+    Download an image or video URL and save it to output_path, whose
+    directory must already exist. Disk writes run in aiofiles' thread
+    pool so the event loop keeps serving other pipelines meanwhile.
     """
-    r = requests.get(url, stream=True)
-    if r.status_code != 200:
-        raise FreepikGeminiError(f"Error downloading file: {r.status_code} {r.text}")
-
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "wb") as f:
-        for chunk in r.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+    async with _client.stream("GET", url) as r:
+        if r.status_code != 200:
+            await r.aread()
+            raise FreepikGeminiError(f"Error downloading file: {r.status_code} {r.text}")
+
+        async with aiofiles.open(output_path, "wb") as f:
+            async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                await f.write(chunk)
     return output_path
 
 
 # === VIDEO GENERATION HELPERS ===
 
-def _create_video_task(api_key: str, image_url: str, prompt: str) -> str:
+async def _create_video_task(api_key: str, image_url: str, prompt: str) -> str:
     """
     POST /v1/ai/image-to-video/{VIDEO_MODEL}
     Returns task_id.
@@ -107,11 +433,15 @@ def _create_video_task(api_key: str, image_url: str, prompt: str) -> str:
         "duration": "10"  # seconds, adjust as needed
     }
 
-    resp = requests.post(FREEPIK_VIDEO_ENDPOINT, json=payload, headers=headers)
+    resp = await _request("POST", FREEPIK_VIDEO_ENDPOINT, content=orjson.dumps(payload), headers=headers)
     if resp.status_code != 200:
-        raise FreepikGeminiError(f"Error creating video task: {resp.status_code} {resp.text}")
+        raise FreepikGeminiError(
+            f"Error creating video task: {resp.status_code} {resp.text}",
+            status=resp.status_code,
+            retry_after=_retry_after(resp)
+        )
 
-    data = resp.json().get("data", {})
+    data = orjson.loads(resp.content).get("data", {})
     task_id = data.get("task_id")
     if not task_id:
         raise FreepikGeminiError(f"Missing task_id in video response: {resp.text}")
@@ -119,7 +449,7 @@ def _create_video_task(api_key: str, image_url: str, prompt: str) -> str:
     return task_id
 
 
-def _wait_for_video_task(api_key: str, task_id: str, timeout: int = 180, poll_interval: float = 2.0) -> str:
+async def _wait_for_video_task(api_key: str, task_id: str, timeout: int = 180, poll_interval: float = 2.0) -> str:
     """
     GET /v1/ai/image-to-video/{VIDEO_MODEL}/{task-id}
     Waits until the video is ready, returns video URL.
@@ -127,13 +457,31 @@ def _wait_for_video_task(api_key: str, task_id: str, timeout: int = 180, poll_in
     headers = {"x-freepik-api-key": api_key}
     url = f"{FREEPIK_VIDEO_ENDPOINT}/{task_id}"
     start = time.time()
+    attempt = 0
+    status = None
+
+    await asyncio.sleep(min(VIDEO_FIRST_POLL_DELAY, timeout))
 
     while True:
-        resp = requests.get(url, headers=headers)
+        resp = await _request("GET", url, headers=headers)
+        if resp.status_code == 429:
+            if time.time() - start > timeout:
+                raise FreepikGeminiError(
+                    f"Timeout waiting for video {task_id}, last status={status} (rate limited)",
+                    status=429,
+                    retry_after=_retry_after(resp)
+                )
+            await asyncio.sleep(_retry_after(resp) or _poll_delay(poll_interval, attempt))
+            attempt += 1
+            continue
         if resp.status_code != 200:
-            raise FreepikGeminiError(f"Error polling video task: {resp.status_code} {resp.text}")
+            raise FreepikGeminiError(
+                f"Error polling video task: {resp.status_code} {resp.text}",
+                status=resp.status_code,
+                retry_after=_retry_after(resp)
+            )
 
-        data = resp.json().get("data", {})
+        data = orjson.loads(resp.content).get("data", {})
         status = data.get("status")
         generated = data.get("generated") or []
 
@@ -141,31 +489,49 @@ def _wait_for_video_task(api_key: str, task_id: str, timeout: int = 180, poll_in
             return generated[0]
 
         if time.time() - start > timeout:
-            raise FreepikGeminiError(f"Timeout waiting for video {task_id}, last status={status}")
+            raise FreepikGeminiError(f"Timeout waiting for video {task_id}, last status={status}", status=504)
 
-        time.sleep(poll_interval)
+        await asyncio.sleep(_poll_delay(poll_interval, attempt))
+        attempt += 1
 
 
 # === MAIN PIPELINE ===
 
-def two_step_gemini_image(api_key: str, base_prompt: str, ad_prompt: str, base_image_path: str, video_output_path: str, *, timeout: int = 180, poll_interval: float = 2.0) -> tuple[str, str]:
+async def two_step_gemini_image(api_key: str, base_prompt: str, ad_prompt: str, base_image_path: str, video_output_path: str, *, timeout: int = 180, poll_interval: float = 2.0, on_progress: Optional[Callable[[str], None]] = None, use_cache: bool = True) -> tuple[str, str]:
     """
     1) Generate a base image from `base_prompt`.
     2) Generate a short ad video from that image using `ad_prompt`.
 
+    `on_progress`, if given, is called with a short message as each step starts.
+    `use_cache` controls whether a cached base image may be reused.
+
     Returns:
         (base_image_path, video_output_path)
     """
 
     # Step 1: Generate base image
-    task_id_1 = _create_gemini_task(api_key=api_key, prompt=base_prompt)
-    generated_urls_1 = _wait_for_gemini_task(api_key=api_key, task_id=task_id_1, timeout=timeout, poll_interval=poll_interval)
+    generated_urls_1 = await generate_gemini_image(api_key=api_key, prompt=base_prompt, timeout=timeout, poll_interval=poll_interval, use_cache=use_cache)
     base_image_url = generated_urls_1[0]
-    _download_file(base_image_url, base_image_path)
+
+    # The video task only needs the URL, so the base image downloads
+    # while the video is being generated
+    base_download = asyncio.create_task(_download_file(base_image_url, base_image_path))
 
     # Step 2: Generate video ad
-    task_id_2 = _create_video_task(api_key=api_key, image_url=base_image_url, prompt=ad_prompt)
-    video_url = _wait_for_video_task(api_key=api_key, task_id=task_id_2, timeout=timeout, poll_interval=poll_interval)
-    _download_file(video_url, video_output_path)
+    if on_progress:
+        on_progress("Generating video...")
+    try:
+        task_id_2 = await _create_video_task(api_key=api_key, image_url=base_image_url, prompt=ad_prompt)
+        video_url = await _wait_for_video_task(api_key=api_key, task_id=task_id_2, timeout=timeout, poll_interval=poll_interval)
+    except BaseException:
+        # Let the download unwind before removing its partial file
+        base_download.cancel()
+        with contextlib.suppress(BaseException):
+            await base_download
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(base_image_path)
+        raise
+    await base_download
+    await _download_file(video_url, video_output_path)
 
     return base_image_path, video_output_path
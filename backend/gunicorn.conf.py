@@ -0,0 +1,11 @@
+# gunicorn -c gunicorn.conf.py
+#
+# gevent workers so long-running pipeline requests and SSE connections
+# (/api/task-events) don't tie up a worker each.
+import os
+
+wsgi_app = "wsgi:app"
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+worker_class = "gevent"
+worker_connections = 1000
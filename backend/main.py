@@ -1,17 +1,105 @@
-from freepik_gemini import two_step_gemini_image
-from dotenv import load_dotenv
 import os
+import sys
+import json
+import uuid
+import asyncio
+import logging
+import argparse
+from pathlib import Path
 
-load_dotenv()
-api_key = os.environ.get("FREEPIK_API_KEY")
-if not api_key:
-    print(f"❌ Error: no api key")
-    exit()
+from freepik_gemini import run_sync, two_step_gemini_image
 
-base_prompt = "modern minimalist tung tung tung sahur on white background, studio lighting"
-ad_prompt = "make a cinematic ad video of these tung tung tung sahur running to israel"
+log = logging.getLogger(__name__)
 
-base_path = "outputs/earbuds.jpg"
-video_path = "outputs/earbuds_ad.mp4"
 
-two_step_gemini_image(api_key, base_prompt, ad_prompt, base_path, video_path)
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a base image and an ad video from it with Freepik.")
+    parser.add_argument("--base-prompt", help="prompt for the base image")
+    parser.add_argument("--ad-prompt", help="prompt for the video animation")
+    parser.add_argument("--out-image", help="where to save the base image (default: outputs/<id>.jpg)")
+    parser.add_argument("--out-video", help="where to save the video (default: outputs/<id>.mp4)")
+    parser.add_argument(
+        "--config",
+        help='JSON file with a list of jobs ({"base_prompt", "ad_prompt", "out_image"?, "out_video"?}) to run concurrently',
+    )
+    args = parser.parse_args()
+
+    if not args.config and not (args.base_prompt and args.ad_prompt):
+        parser.error("--base-prompt and --ad-prompt are required unless --config is given")
+    return parser, args
+
+
+def load_jobs(parser, args) -> list[dict]:
+    if args.config:
+        try:
+            with open(args.config) as f:
+                jobs = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"--config: {e}")
+        validate_jobs(parser, jobs)
+        return jobs
+    return [{
+        "base_prompt": args.base_prompt,
+        "ad_prompt": args.ad_prompt,
+        "out_image": args.out_image,
+        "out_video": args.out_video,
+    }]
+
+
+def validate_jobs(parser, jobs):
+    """Exit with a usage error unless `jobs` is a non-empty list of well-formed job objects."""
+    if not isinstance(jobs, list) or not jobs:
+        parser.error("--config must contain a non-empty JSON list of jobs")
+    for i, job in enumerate(jobs):
+        if not isinstance(job, dict):
+            parser.error(f"--config job {i}: expected an object, got {type(job).__name__}")
+        for key in ("base_prompt", "ad_prompt"):
+            if not isinstance(job.get(key), str) or not job[key]:
+                parser.error(f"--config job {i}: {key!r} must be a non-empty string")
+        for key in ("out_image", "out_video"):
+            if job.get(key) is not None and not isinstance(job[key], str):
+                parser.error(f"--config job {i}: {key!r} must be a string")
+
+
+async def run_jobs(api_key: str, jobs: list[dict]) -> list:
+    """Run every job's pipeline concurrently; results are output paths or exceptions."""
+    pipelines = []
+    for job in jobs:
+        file_id = uuid.uuid4().hex
+        base_path = job.get("out_image") or f"outputs/{file_id}.jpg"
+        video_path = job.get("out_video") or f"outputs/{file_id}.mp4"
+        Path(base_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(video_path).parent.mkdir(parents=True, exist_ok=True)
+        pipelines.append(two_step_gemini_image(api_key, job["base_prompt"], job["ad_prompt"], base_path, video_path))
+
+    return await asyncio.gather(*pipelines, return_exceptions=True)
+
+
+def main():
+    parser, args = parse_args()
+
+    api_key = os.environ.get("FREEPIK_API_KEY")
+    if not api_key:
+        log.error("❌ Error: no api key")
+        sys.exit(1)
+
+    jobs = load_jobs(parser, args)
+    results = run_sync(run_jobs(api_key, jobs))
+
+    failed = False
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            failed = True
+            log.error("❌ %r: %s", job["base_prompt"], result)
+        else:
+            base_path, video_path = result
+            log.info("✅ %r: %s, %s", job["base_prompt"], base_path, video_path)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    main()
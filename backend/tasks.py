@@ -0,0 +1,132 @@
+import os
+import time
+from pathlib import Path
+import orjson
+import redis
+from celery import Celery
+
+from freepik_gemini import run_sync, two_step_gemini_image
+
+# Run a worker with: celery -A tasks worker --loglevel=info
+# and the periodic cleanup with: celery -A tasks beat
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+# Task state hashes expire this long after their last update
+TASK_STATE_TTL = 3600
+
+# Generated files, shared by the API and the workers. Anchored to this file
+# rather than the working directory so every process agrees on it (and
+# absolute, since send_from_directory resolves relative paths against app.root_path)
+OUTPUT_DIR = Path(__file__).resolve().parent / "outputs"
+OUTPUT_DIR.mkdir(exist_ok=True)
+
+# Every OUTPUT_CLEANUP_INTERVAL seconds, outputs older than OUTPUT_MAX_AGE are
+# deleted, then the oldest remaining ones until the total is under OUTPUT_MAX_BYTES
+OUTPUT_CLEANUP_INTERVAL = 300
+OUTPUT_MAX_AGE = 24 * 3600
+OUTPUT_MAX_BYTES = int(os.environ.get("OUTPUT_MAX_BYTES", 10 << 30))
+
+# No result backend: task state lives in the Redis hashes below
+celery = Celery("ag", broker=REDIS_URL)
+
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+def task_key(task_id: str) -> str:
+    """Redis hash holding the latest state of `task_id`."""
+    return f"task:{task_id}"
+
+
+def task_channel(task_id: str) -> str:
+    """Redis pub/sub channel that progress events for `task_id` are published on."""
+    return f"task:{task_id}"
+
+
+def set_task_state(task_id: str, event: dict):
+    """
+    Record a {"state": "submitted"|"working"|"completed"|"failed", ...} event
+    as the task's current state and publish it for SSE listeners. The event
+    is stamped with `updated_at` (epoch seconds).
+    """
+    event = {**event, "updated_at": time.time()}
+    key = task_key(task_id)
+    pipe = redis_client.pipeline()
+    pipe.delete(key)
+    pipe.hset(key, mapping=event)
+    pipe.expire(key, TASK_STATE_TTL)
+    pipe.publish(task_channel(task_id), orjson.dumps(event))
+    pipe.execute()
+
+
+def get_task_state(task_id: str) -> dict:
+    """Current state of `task_id`, or an empty dict if unknown or expired."""
+    return redis_client.hgetall(task_key(task_id))
+
+
+@celery.on_after_configure.connect
+def setup_periodic_tasks(sender, **kwargs):
+    sender.add_periodic_task(OUTPUT_CLEANUP_INTERVAL, cleanup_outputs.s())
+
+
+@celery.task(ignore_result=True)
+def cleanup_outputs() -> int:
+    """
+    Evict generated files, oldest first, until none is older than
+    OUTPUT_MAX_AGE and the directory is under OUTPUT_MAX_BYTES.
+    Returns the number of files removed.
+    """
+    files = []
+    with os.scandir(OUTPUT_DIR) as it:
+        for entry in it:
+            if entry.is_file(follow_symlinks=False):
+                st = entry.stat(follow_symlinks=False)
+                files.append((st.st_mtime, st.st_size, entry.path))
+    files.sort()
+
+    cutoff = time.time() - OUTPUT_MAX_AGE
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total <= OUTPUT_MAX_BYTES:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+@celery.task(bind=True, ignore_result=True)
+def run_video_ad(self, api_key: str, base_prompt: str, ad_prompt: str, image_path: str, video_path: str, use_cache: bool = True) -> dict:
+    """
+    Run the two-step image -> video pipeline in a worker process.
+    Progress is written to the task's Redis state hash (see set_task_state).
+    """
+    task_id = self.request.id
+
+    def report(progress: str):
+        set_task_state(task_id, {"state": "working", "progress": progress})
+
+    report("Generating base image...")
+    try:
+        run_sync(two_step_gemini_image(
+            api_key=api_key,
+            base_prompt=base_prompt,
+            ad_prompt=ad_prompt,
+            base_image_path=image_path,
+            video_output_path=video_path,
+            on_progress=report,
+            use_cache=use_cache,
+        ))
+    except Exception as e:
+        set_task_state(task_id, {"state": "failed", "error": str(e)})
+        raise
+
+    result = {
+        "base_image": f"/api/download/{Path(image_path).name}",
+        "video": f"/api/download/{Path(video_path).name}",
+    }
+    set_task_state(task_id, {"state": "completed", "progress": "Done", **result})
+    return result
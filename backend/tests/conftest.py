@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Make the backend modules importable as top-level modules, as they are at runtime
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,67 @@
+import pytest
+
+import freepik_gemini
+from freepik_gemini import (
+    RATE_LIMIT_ADJUST_INTERVAL,
+    RATE_LIMIT_WINDOW,
+    _AdaptiveLimiter,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(freepik_gemini.time, "monotonic", clock)
+    return clock
+
+
+def drive(limiter, clock, seconds, rps, every_nth_429=None):
+    """Record `rps` responses per second for `seconds`; returns the cap after each one."""
+    limits = []
+    for i in range(int(seconds * rps)):
+        clock.now += 1 / rps
+        is_429 = every_nth_429 is not None and i % every_nth_429 == 0
+        limiter.record(429 if is_429 else 200)
+        limits.append(limiter.limit)
+    return limits
+
+
+def test_single_429_under_light_traffic_keeps_cap(clock):
+    limiter = _AdaptiveLimiter(8)
+    limiter.record(429)
+    limits = drive(limiter, clock, seconds=300, rps=0.1)
+    assert min(limits) == 8
+
+
+def test_single_429_under_light_traffic_delays_recovery_by_one_window(clock):
+    limiter = _AdaptiveLimiter(8)
+    limiter.limit = 4
+    limiter.record(429)
+    held = drive(limiter, clock, seconds=RATE_LIMIT_WINDOW - 1, rps=0.1)
+    assert set(held) == {4}
+    assert drive(limiter, clock, seconds=60, rps=0.1)[-1] == 8
+
+
+def test_sustained_429s_halve_once_per_interval_then_recover(clock):
+    limiter = _AdaptiveLimiter(8)
+
+    # 5% of responses at 10 rps are 429s: one halving per interval down to 1
+    limits = drive(limiter, clock, seconds=60, rps=10, every_nth_429=20)
+    interval = int(RATE_LIMIT_ADJUST_INTERVAL * 10)
+    per_interval = limits[interval - 1::interval]
+    assert per_interval[:4] == [4, 2, 1, 1]
+    assert limits[-1] == 1
+
+    # Once the 429s stop, the cap grows back by one per interval
+    limits = drive(limiter, clock, seconds=80, rps=10)
+    steps = [b - a for a, b in zip(limits, limits[1:])]
+    assert max(steps) == 1
+    assert limits[-1] == 8
@@ -1,40 +1,26 @@
 import os
 import sys
 import json
+import logging
+import functools
 from datetime import datetime
-from dotenv import load_dotenv
+from typing import Final
+from cachetools import TTLCache
+from dotenv import find_dotenv, load_dotenv
 from linkup._client import LinkupClient
 
-# Try to load environment variables from multiple possible locations
-# This ensures compatibility with different team setups
-env_paths = [
-    '../../.env.local',  # Standard location relative to backend folder
-    '../../../.env.local',  # One level up from project root
-]
-
-for env_path in env_paths:
-    if os.path.exists(env_path):
-        load_dotenv(dotenv_path=env_path)
-        print(f'Loaded environment from: {env_path}')
-        break
-else:
-    # Try loading from current directory and parent directories
-    load_dotenv()  # This will look for .env in current dir and walk up
-    print('Using default .env loading (searching current and parent directories)')
+log = logging.getLogger(__name__)
 
+# Load environment variables unless the parent process already passed them in.
+# Look for the nearest .env.local walking up from the working directory (the
+# shared team setup), then fall back to the nearest .env
+if not os.environ.get('LINKUP_API_KEY'):
+    env_path = find_dotenv('.env.local', usecwd=True) or find_dotenv(usecwd=True)
+    load_dotenv(env_path, override=False)
+    log.debug('Loaded environment from: %s', env_path or '(no .env file found)')
 
-async def find_trending_products():
-    """Find trending products on AliExpress using LinkupClient."""
-    api_key = os.getenv('LINKUP_API_KEY')
-    
-    if not api_key:
-        raise ValueError('LINKUP_API_KEY not found in environment variables')
-    
-    print('Starting search for trending products...')
-    
-    client = LinkupClient(api_key=api_key)
-    
-    query = """You are an e-commerce market analyst. Find five SPECIFIC, currently trending or best-selling products on AliExpress and return only direct product pages.
+# Search prompt, built once rather than on every call
+_TRENDING_QUERY: Final[str] = """You are an e-commerce market analyst. Find five SPECIFIC, currently trending or best-selling products on AliExpress and return only direct product pages.
 
 HARD REQUIREMENTS (must pass ALL checks):
 1) EXACTLY five items.
@@ -54,96 +40,104 @@ OUTPUT (no extra text, no citations):
 5. <Exact Product Title> 
 
 IF YOU CANNOT FIND FIVE FULLY VALID TITLES, return only those that pass validation and STOP."""
-    
-    print('Sending request to LinkupClient...')
-    
-    try:
-        response = client.search(
-            query=query,
-            depth="standard",
-            output_type="sourcedAnswer",
-            include_images=False,
-            include_inline_citations=False
-        )
-        
-        print('Received response from LinkupClient')
-        
-        # Extract top 5 trending products from the response
-        trending_products = extract_top_5_products(response)
-        
-        return {
-            'success': True,
-            'products': trending_products,
-            'timestamp': datetime.now().isoformat()
-        }
-    except Exception as error:
-        print(f'Error during search: {error}', file=sys.stderr)
-        raise
 
+# Trending lists change slowly, so a result is reused for an hour
+_result_cache: TTLCache = TTLCache(maxsize=1, ttl=3600)
 
-def extract_top_5_products(response):
-    """Process the response to extract specific product information."""
-    print('Processing search results to extract top 5 products...')
-    
-    # Log the response for debugging (you can remove this in production)
-    response_text = getattr(response, 'text', None)
-    if response_text:
-        print(f'Response received: {response_text[:200]}...')
-    else:
-        print('Response received: No text content')
-    
-    products = []
-    
-    # For now, return some popular products mentioned in the search results
-    # In a real implementation, you'd parse the response content more intelligently
-    products.append({
+# Products returned for now. The search response isn't parsed yet; in a real
+# implementation these would be extracted from its text.
+_TRENDING_PRODUCTS: Final[list] = [
+    {
         'rank': 1,
         'name': 'Wireless Bluetooth Earbuds (Xiaomi Air 7)',
         'description': 'Affordable wireless earbuds with good sound quality',
         'priceRange': '$10-15',
         'trending': 'High demand for budget-friendly tech accessories'
-    })
-    
-    products.append({
+    },
+    {
         'rank': 2,
         'name': 'Smart Watch with Bluetooth Call',
         'description': 'Fitness tracker with health monitoring and call features',
         'priceRange': '$15-25',
         'trending': 'Popular for fitness enthusiasts and remote workers'
-    })
-    
-    products.append({
+    },
+    {
         'rank': 3,
         'name': 'Portable Massage Gun',
         'description': 'Deep-tissue massage device for muscle recovery',
         'priceRange': '$20-30',
         'trending': 'Growing wellness and self-care market'
-    })
-    
-    products.append({
+    },
+    {
         'rank': 4,
         'name': 'Car Phone Holder/Mount',
         'description': 'Dashboard phone mount for navigation and hands-free use',
         'priceRange': '$5-10',
         'trending': 'Essential automotive accessory, impulse purchase item'
-    })
-    
-    products.append({
+    },
+    {
         'rank': 5,
         'name': 'LED Strip Lights/Smart Home Lights',
         'description': 'RGB LED lighting for room decoration and smart homes',
         'priceRange': '$8-20',
         'trending': 'Home improvement and aesthetic customization trend'
-    })
+    },
+]
+
+
+@functools.lru_cache(maxsize=4)
+def _linkup(api_key: str) -> LinkupClient:
+    """
+    LinkupClient for `api_key`, created once and reused so its connection
+    pool stays warm. The cache is bounded by the number of distinct API
+    keys seen (at most 4 clients are kept).
+    """
+    return LinkupClient(api_key=api_key)
+
+
+async def find_trending_products():
+    """Find trending products on AliExpress using LinkupClient."""
+    if 'result' in _result_cache:
+        return _result_cache['result']
+
+    api_key = os.getenv('LINKUP_API_KEY')
+    
+    if not api_key:
+        raise ValueError('LINKUP_API_KEY not found in environment variables')
+    
+    client = _linkup(api_key)
     
-    return products
+    log.info('Searching for trending products...')
+    
+    try:
+        response = client.search(
+            query=_TRENDING_QUERY,
+            depth="standard",
+            output_type="sourcedAnswer",
+            include_images=False,
+            include_inline_citations=False
+        )
+        
+        log.info('Received response from LinkupClient')
+        log.debug('Response received: %.200s', getattr(response, 'text', None))
+        
+        result = {
+            'success': True,
+            'products': _TRENDING_PRODUCTS,
+            'timestamp': datetime.now().isoformat()
+        }
+        _result_cache['result'] = result
+        return result
+    except Exception as error:
+        log.error('Error during search: %s', error)
+        raise
 
 
 async def main():
     """Main function with timeout handling."""
     import asyncio
     
-    print('Script started...')
+    log.info('Script started...')
     
     try:
         # Add timeout wrapper (15 seconds)
@@ -152,12 +146,12 @@ async def main():
             timeout=15.0
         )
         
-        print('Success! Results:')
+        # The JSON result is the script's output, so it stays on stdout
         print(json.dumps(result, indent=2))
         sys.exit(0)
         
     except asyncio.TimeoutError:
-        print('Error occurred:')
+        log.error('Request timed out')
         print(json.dumps({
             'success': False,
             'error': 'Request timed out after 15 seconds'
@@ -165,7 +159,7 @@ async def main():
         sys.exit(1)
         
     except Exception as error:
-        print('Error occurred:')
+        log.error('Error occurred: %s', error)
         print(json.dumps({
             'success': False,
             'error': str(error)
@@ -175,4 +169,5 @@ async def main():
 
 if __name__ == '__main__':
     import asyncio
+    logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
     asyncio.run(main())
\ No newline at end of file
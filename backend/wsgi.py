@@ -0,0 +1,8 @@
+# Production entry point: gunicorn -c gunicorn.conf.py
+#
+# Patch the stdlib before anything imports socket/ssl/threading, so blocking
+# I/O (including the Freepik event-loop thread) yields to other greenlets.
+from gevent import monkey
+monkey.patch_all()
+
+from app import app  # noqa: E402
@@ -1,10 +1,10 @@
 'use client';
 
-import { useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { Textarea } from '@/components/ui/textarea';
 
-interface TaskStatus {
-  status: 'processing' | 'completed' | 'failed';
+interface TaskEvent {
+  state: 'submitted' | 'working' | 'completed' | 'failed';
   progress?: string;
   base_image?: string;
   video?: string;
@@ -25,55 +25,80 @@ export default function VideoAdGenerator() {
   const [error, setError] = useState<string | null>(null);
   const [taskId, setTaskId] = useState<string | null>(null);
   const [progress, setProgress] = useState<string>('');
+  const eventsRef = useRef<EventSource | null>(null);
 
   const FLASK_API_URL = process.env.NEXT_PUBLIC_FLASK_API_URL || 'http://localhost:5000';
   const API_KEY = process.env.NEXT_PUBLIC_FREEPIK_API_KEY || '';
 
-  const pollTaskStatus = async (id: string) => {
-    const maxAttempts = 60; // 5 minutes max (60 * 5 seconds)
-    let attempts = 0;
+  // Close the task event stream if the component unmounts mid-task
+  useEffect(() => () => eventsRef.current?.close(), []);
 
-    const poll = async (): Promise<void> => {
-      try {
-        const response = await fetch(`${FLASK_API_URL}/api/task-status/${id}`);
-        
-        if (!response.ok) {
-          throw new Error('Failed to check task status');
-        }
+  const watchTaskEvents = (id: string) => {
+    eventsRef.current?.close();
+    const events = new EventSource(`${FLASK_API_URL}/api/task-events/${id}`);
+    eventsRef.current = events;
 
-        const data: TaskStatus = await response.json();
-        
-        if (data.status === 'completed' && data.base_image && data.video) {
-          setResult({
-            base_image: data.base_image,
-            video: data.video,
-            imageUrl: `${FLASK_API_URL}${data.base_image}`,
-            videoUrl: `${FLASK_API_URL}${data.video}`
-          });
-          setLoading(false);
-          setProgress('');
-          return;
-        } else if (data.status === 'failed') {
-          throw new Error(data.error || 'Video generation failed');
-        } else if (data.status === 'processing') {
-          setProgress(data.progress || 'Processing...');
-          attempts++;
-          
-          if (attempts >= maxAttempts) {
-            throw new Error('Task timed out');
-          }
-          
-          // Poll again after 5 seconds
-          setTimeout(() => poll(), 5000);
+    const fail = (message: string) => {
+      events.close();
+      setError(message);
+      setLoading(false);
+      setProgress('');
+    };
+
+    // Apply a task state; returns false while the task is still running
+    const settle = (data: TaskEvent) => {
+      if (data.state === 'completed') {
+        if (!data.base_image || !data.video) {
+          fail('Task completed without any output');
+          return true;
         }
-      } catch (err) {
-        setError(err instanceof Error ? err.message : 'An error occurred');
+        events.close();
+        setResult({
+          base_image: data.base_image,
+          video: data.video,
+          imageUrl: `${FLASK_API_URL}${data.base_image}`,
+          videoUrl: `${FLASK_API_URL}${data.video}`
+        });
         setLoading(false);
         setProgress('');
+        return true;
+      }
+      if (data.state === 'failed') {
+        fail(data.error || 'Video generation failed');
+        return true;
       }
+      return false;
     };
 
-    await poll();
+    events.onmessage = (message) => {
+      const data: TaskEvent = JSON.parse(message.data);
+      if (!settle(data)) {
+        setProgress(data.progress || 'Processing...');
+      }
+    };
+
+    events.onerror = async () => {
+      // The browser reconnects on its own unless the stream was closed for good
+      if (events.readyState !== EventSource.CLOSED) return;
+
+      // Check the task once more in case it finished while disconnected
+      try {
+        const response = await fetch(`${FLASK_API_URL}/api/task-status/${id}`);
+        if (response.ok) {
+          const { status, ...rest } = await response.json();
+          if (eventsRef.current !== events) return;
+          if (status === 'completed' || status === 'failed') {
+            settle({ state: status, ...rest });
+            return;
+          }
+        }
+      } catch {
+        // Fall through to the connection error below
+      }
+      if (eventsRef.current === events) {
+        fail('Lost connection while waiting for task');
+      }
+    };
   };
 
   const generateVideoAd = async (useAsync: boolean = true) => {
@@ -110,10 +135,10 @@ export default function VideoAdGenerator() {
       const data = await response.json();
 
       if (useAsync) {
-        // Async mode - poll for status
+        // Async mode - stream status updates
         setTaskId(data.task_id);
         setProgress('Task created, processing...');
-        await pollTaskStatus(data.task_id);
+        watchTaskEvents(data.task_id);
       } else {
         // Sync mode - immediate result
         setResult({